@@ -1,6 +1,4 @@
 import streamlit as st
-import pandas as pd
-import re
 from io import BytesIO
 
 # ---- Page config ----
@@ -24,8 +22,29 @@ if "auth" not in st.session_state or not st.session_state["auth"]:
     login()
     st.stop()
 
+# Heavy imports only after sign-in, so the login screen doesn't wait for pandas/numpy
+import csv
+import re
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+
 # ===== Helpers =====
 
+# CSV statements are streamed and filtered in blocks of this many bytes to bound peak memory
+CSV_BLOCK_BYTES = 16 << 20
+
+# ...or, when pyarrow rejects the file (ragged rows), read by pandas in chunks of this many rows
+CSV_CHUNK_ROWS = 100_000
+
+# Below this many IPN candidates the scalar checksum beats the array/numba setup
+IPN_BATCH_MIN = 64
+
+# Arrow-backed string dtype for the purpose text (contiguous UTF-8 buffers, no per-cell PyObject)
+STR_DTYPE = pd.StringDtype("pyarrow")
+
 def _clean_header(s: str) -> str:
     """Normalize header: strip spaces/NBSP/BOM and collapse whitespace."""
     if s is None:
@@ -44,83 +63,451 @@ def pick_col(df: pd.DataFrame, candidates):
     return None
 
 # VD: 5 digits right after "ВД", optional spaces and optional "№"
-RE_VD = re.compile(r"(?i)\bВД\s*№?\s*(\d{5})\b")
+PAT_VD = r"\bВД\s*№?\s*(?P<VD>\d{5})\b"
 
 # VP: 8 digits after "ВП" (works with/without spaces and optional "№")
 # Extra rule: after ';', '; ', or '; №', take 8 digits starting with '6' and ending before ';'
-RE_VP = re.compile(r"(?i)вп\s*№?\s*([0-9]{8})")
-RE_VP_SEMI = re.compile(r";\s*(?:№\s*)?(6\d{7})\s*;")
+PAT_VP = r"вп\s*№?\s*(?P<VP>[0-9]{8})"
+PAT_VP_SEMI = r";\s*(?:№\s*)?(?P<VP_SEMI>6\d{7})\s*;"
 
-# IPN: any 10 consecutive digits (validated by checksum)
-RE_IPN_10 = re.compile(r"\b(\d{10})\b")
+# IPN: any 10 consecutive ASCII digits (validated by checksum)
+PAT_IPN_10 = r"\b(?P<IPN>[0-9]{10})\b"
 
 # CaseID: 6 digits starting with 1 or 2, right after a word containing "іден"/"иден"/"iden"
-RE_CASEID = re.compile(r"(?iu)\b[\w\-]*[іиi]ден[\w\-]*\b[\s:;#№\-]*([12]\d{5})")
+PAT_CASEID = r"\b[\w\-]*[іиi]ден[\w\-]*\b[\s:;#№\-]*(?P<CASEID>[12]\d{5})"
 
 # Name after explicit marker "Боржник:"
-NAME_AFTER_BORZHNIK = re.compile(
-    r"(?i)боржник\s*:\s*([А-ЯA-ZІЇЄҐ][А-Яа-яA-Za-zІЇЄҐіїєґ'`-]+(?:\s+[А-ЯA-ZІЇЄҐ][А-Яа-яA-Za-zІЇЄҐіїєґ'`-]+){1,2})"
-)
-
-def extract_vd(text: str) -> str:
-    m = RE_VD.search(str(text))
-    return m.group(1) if m else ""
-
-def extract_vp(text: str) -> str:
-    s = str(text)
-    m = RE_VP.search(s)
-    if m:
-        return m.group(1)
-    m2 = RE_VP_SEMI.search(s)
-    if m2:
-        return m2.group(1)
-    return ""
-
-def ipn_control_digit_first9(d9: list[int]) -> int:
-    """RNOKPP checksum: weights [-1,5,7,9,4,6,10,5,7] then ((sum % 11) % 10)."""
-    weights = [-1, 5, 7, 9, 4, 6, 10, 5, 7]
-    s = sum(x * w for x, w in zip(d9, weights))
-    return (s % 11) % 10
+PAT_NAME = r"боржник\s*:\s*(?P<NAME>[А-ЯA-ZІЇЄҐ][А-Яа-яA-Za-zІЇЄҐіїєґ'`-]+(?:\s+[А-ЯA-ZІЇЄҐ][А-Яа-яA-Za-zІЇЄҐіїєґ'`-]+){1,2})"
+
+# Amount cleanup after ',' -> '.': drop everything but digits, '.' and '-' (spaces, NBSP, currency)
+PAT_AMOUNT_JUNK = r"[^0-9.\-]"
+
+# Date layouts recognised by normalize_date_series: (sample pattern, to_datetime format)
+DATE_FORMATS = [
+    (r"\d{1,2}\.\d{1,2}\.\d{4}", "%d.%m.%Y"),
+    (r"\d{1,2}/\d{1,2}/\d{4}", "%d/%m/%Y"),
+    (r"\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}:\d{2})?", "ISO8601"),
+]
+
+# Summary/footer rows like "Всього за оборотами:" and "Кінцевий залишок:"
+PAT_SUMMARY = r"(всього\s+за\s+оборотами|кінцевий\s+залишок)"
+
+@st.cache_resource
+def get_patterns() -> dict:
+    """Compiled regexes and the IPN weights, built once per server process instead of on every rerun."""
+    return {
+        # Field patterns in one alternation, so each purpose string is scanned once. Every branch
+        # is a lookahead, so matches of different fields may overlap; finditer still reports one
+        # branch per position, which is safe only because these branches never start on the same
+        # character (ВД / вп / ';' / digit / боржник).
+        "fields": re.compile(
+            "|".join(f"(?={p})" for p in [PAT_VD, PAT_VP, PAT_VP_SEMI, PAT_IPN_10, PAT_NAME]),
+            re.IGNORECASE,
+        ),
+        # CaseID's leading word can start on a VD/VP/IPN token glued to it ("вп61234567ідент"),
+        # so it gets its own search
+        "caseid": re.compile(PAT_CASEID, re.IGNORECASE),
+        "summary": re.compile(PAT_SUMMARY, re.IGNORECASE),
+        # RNOKPP checksum weights for the first 9 digits
+        "ipn_weights": np.array([-1, 5, 7, 9, 4, 6, 10, 5, 7], dtype=np.int32),
+    }
 
 def is_valid_ipn(s: str) -> bool:
-    if not (s and s.isdigit() and len(s) == 10):
-        return False
-    d = [int(ch) for ch in s]
-    return d[9] == ipn_control_digit_first9(d[:9])
-
-def extract_ipn(text: str) -> str:
-    for m in RE_IPN_10.finditer(str(text)):
-        cand = m.group(1)
-        if is_valid_ipn(cand):
-            return cand
-    return ""
-
-def extract_caseid(text: str) -> str:
-    m = RE_CASEID.search(str(text))
-    return m.group(1) if m else ""
-
-def extract_name(text: str) -> str:
-    s = str(text)
-    m = NAME_AFTER_BORZHNIK.search(s)
-    if not m:
-        return ""
-    # remove trailing digits stuck to the name
-    return re.sub(r"\s*\d+\s*$", "", m.group(1)).strip()
+    """RNOKPP checksum for one regex-captured 10-digit string.
+
+    Weights [-1,5,7,9,4,6,10,5,7] on the first 9 digits, then ((sum % 11) % 10) == 10th digit.
+    Works on ASCII codes directly: sum(w * (c - 48)) == sum(w * c) - 48 * sum(w), sum(w) == 52.
+    """
+    d = s.encode("ascii")
+    ctrl = (
+        -d[0] + 5 * d[1] + 7 * d[2] + 9 * d[3] + 4 * d[4] + 6 * d[5] + 10 * d[6] + 5 * d[7] + 7 * d[8] - 48 * 52
+    ) % 11 % 10
+    return d[9] - 48 == ctrl
+
+@st.cache_resource
+def get_ipn_kernel():
+    """Numba kernel picking the first valid IPN per row, or None when numba isn't installed.
+
+    Compiled on first use and cached on disk (cache=True), so restarts skip the JIT step.
+    """
+    try:
+        from numba import njit
+    except ImportError:
+        return None
+
+    # Serial on purpose: Streamlit sessions run on their own threads, and a parallel kernel called
+    # from two of them at once kills the process under numba's workqueue threading layer
+    @njit(cache=True, boundscheck=False)
+    def first_valid_ipn(digits, starts, ends, weights):
+        # Row r owns candidates starts[r]:ends[r] and stops at the first valid one
+        out = np.full(len(starts), -1, dtype=np.int64)
+        for r in range(len(starts)):
+            for i in range(starts[r], ends[r]):
+                s = 0
+                for k in range(9):
+                    s += digits[i, k] * weights[k]
+                if s % 11 % 10 == digits[i, 9]:
+                    out[r] = i
+                    break
+        return out
+
+    return first_valid_ipn
+
+def pick_valid_ipn(cands: pd.Series, index: pd.Index) -> pd.Series:
+    """First checksum-valid candidate per row ("" if none); `cands` is indexed by row, in text order.
+
+    All candidates are validated at once on an (N, 10) digit array: in one numba pass when
+    available, otherwise with a single NumPy matmul. Small batches use the scalar is_valid_ipn,
+    which is cheaper than building the array.
+    """
+    out = pd.Series("", index=index, dtype=object)
+    if len(cands) < IPN_BATCH_MIN:
+        valid = cands[[is_valid_ipn(c) for c in cands]]
+        first = valid[~valid.index.duplicated()]
+        out.loc[first.index] = first.to_numpy()
+        return out
+    # ASCII -> digit values in NumPy (uint8, no widening copy); the kernel only sees numbers
+    digits = np.frombuffer("".join(cands).encode("ascii"), dtype=np.uint8).reshape(-1, 10) - ord("0")
+    weights = get_patterns()["ipn_weights"]
+    kernel = get_ipn_kernel()
+    if kernel is not None:
+        rows = cands.index.to_numpy()
+        starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])  # candidates of a row are contiguous
+        ends = np.r_[starts[1:], len(rows)]
+        hits = kernel(digits, starts, ends, weights)
+        first = cands.iloc[hits[hits >= 0]]
+    else:
+        ctrl = (digits[:, :9] @ weights) % 11 % 10
+        valid = cands[ctrl == digits[:, 9]]
+        first = valid[~valid.index.duplicated()]
+    out.loc[first.index] = first.to_numpy()
+    return out
+
+def extract_all(
+    text: str, _finditer=get_patterns()["fields"].finditer, _caseid_search=get_patterns()["caseid"].search
+) -> dict:
+    """One pass of the combined field regex plus the CaseID search over a purpose text (a str).
+
+    Returns the first VD / VP / VP_SEMI / CASEID / NAME match (missing keys = not found) and
+    every IPN candidate under "IPN", in text order, for the batched checksum.
+    """
+    found = {"IPN": []}
+    for m in _finditer(text):
+        key = m.lastgroup  # each branch has exactly one (named) group
+        if key == "IPN":
+            found["IPN"].append(m.group(key))
+        elif key not in found:
+            found[key] = m.group(key)
+    m = _caseid_search(text)
+    if m:
+        found["CASEID"] = m.group("CASEID")
+    return found
+
+def extract_fields(purpose: pd.Series) -> pd.DataFrame:
+    """VD / VP / IPN / CaseID / name from purpose texts ("" where not found).
+
+    Statements repeat the same purpose texts, so each distinct text is scanned once and the
+    results are spread back to the rows. The scan is a plain loop over the NumPy array of
+    texts: no per-row Series machinery or extractall frames.
+    """
+    codes, uniq = pd.factorize(purpose)
+    # Distinct texts are all str; missing purposes (code -1) point at a trailing "" entry
+    texts = [*uniq.to_numpy(dtype=object), ""]
+    codes[codes < 0] = len(texts) - 1
+
+    vd, vp, caseid, names = [], [], [], []
+    ipn_rows, ipn_cands = [], []
+    for r, text in enumerate(texts):
+        found = extract_all(text)
+        vd.append(found.get("VD", ""))
+        vp.append(found.get("VP") or found.get("VP_SEMI", ""))
+        caseid.append(found.get("CASEID", ""))
+        names.append(found.get("NAME", ""))
+        ipn_rows.extend([r] * len(found["IPN"]))
+        ipn_cands.extend(found["IPN"])
+
+    index = pd.RangeIndex(len(texts))
+    fields = pd.DataFrame(
+        {
+            "ВД": vd,
+            "ВП": vp,
+            "ІПН": pick_valid_ipn(pd.Series(ipn_cands, index=ipn_rows, dtype=object), index),
+            "CaseID": caseid,
+            "ПІБ": names,
+        },
+        index=index,
+    )
+    return fields.take(codes).set_axis(purpose.index)
 
 def parse_amount(series: pd.Series) -> pd.Series:
-    """Normalize amounts: remove NBSP/spaces, ',' -> '.', drop non-numeric, then to numeric."""
-    amt = (
-        series.astype(str)
-        .str.replace("\u00a0", " ", regex=False)
-        .str.replace(" ", "", regex=False)
-        .str.replace(",", ".", regex=False)
-        .str.replace(r"[^\d\.\-]", "", regex=True)
+    """Normalize amounts: ',' -> '.', drop non-numeric (NBSP/spaces too), then to numeric.
+
+    Runs on Arrow's string kernels, so there is no per-cell Python loop.
+    """
+    text = pa.array(series.astype(STR_DTYPE))
+    text = pc.replace_substring_regex(pc.replace_substring(text, ",", "."), PAT_AMOUNT_JUNK, "")
+    amt = pd.to_numeric(pd.Series(text, index=series.index, dtype=pd.ArrowDtype(pa.string())), errors="coerce")
+    return amt.astype(float)
+
+def parse_credit(series: pd.Series) -> pd.Series:
+    """Credit as float: clean numbers convert directly, only the leftovers go through parse_amount."""
+    amt = pd.to_numeric(series, errors="coerce").astype(float)
+    amt[~np.isfinite(amt)] = np.nan  # "inf"/"Infinity" aren't amounts: clean them like any other text
+    dirty = amt.isna() & series.notna()
+    if dirty.any():
+        amt.loc[dirty] = parse_amount(series.loc[dirty])
+    return amt
+
+def read_csv_chunks(src: BytesIO):
+    """Stream a CSV with pyarrow's multithreaded reader: one DataFrame per block.
+
+    Every column is read as an Arrow string (typing is done downstream), since types inferred
+    from the first block can fail on later blocks (e.g. "1 234,50" in a numeric-looking column).
+    Raises pa.ArrowInvalid on rows with a wrong field count, which pd.read_csv would accept.
+    """
+    names = next(csv.reader([src.readline().decode("utf-8-sig")]), [])  # header line only
+    reader = pacsv.open_csv(
+        src,
+        read_options=pacsv.ReadOptions(block_size=CSV_BLOCK_BYTES, column_names=names),
+        convert_options=pacsv.ConvertOptions(
+            column_types=dict.fromkeys(names, pa.string()), strings_can_be_null=True
+        ),
     )
-    return pd.to_numeric(amt, errors="coerce")
+    types_mapper = {pa.string(): STR_DTYPE}.get
+    empty = True
+    for batch in reader:
+        empty = False
+        yield batch.to_pandas(types_mapper=types_mapper)
+    if empty:  # header-only file: still yield the columns so they can be checked
+        yield reader.schema.empty_table().to_pandas(types_mapper=types_mapper)
+
+def contains_summary(col: pd.Series) -> pd.Series:
+    """Mask of cells holding a footer phrase; numeric/datetime columns can't hold one."""
+    if not (col.dtype == object or isinstance(col.dtype, pd.StringDtype)):
+        return pd.Series(False, index=col.index)
+    return col.astype(STR_DTYPE).str.contains(get_patterns()["summary"], na=False)
+
+def summary_mask(df: pd.DataFrame) -> np.ndarray:
+    """Rows with a footer phrase in any cell: one vectorized scan per text column, OR-ed together."""
+    mask = np.zeros(len(df), dtype=bool)
+    for i in range(df.shape[1]):  # by position: headers may repeat
+        mask |= contains_summary(df.iloc[:, i]).to_numpy()
+    return mask
 
 def normalize_date_series(series: pd.Series) -> pd.Series:
-    """Return pandas datetime64[ns] (Excel-friendly)."""
-    return pd.to_datetime(series, dayfirst=True, errors="coerce")
+    """Return pandas datetime64[ns] (Excel-friendly).
+
+    The format is detected from the first non-empty value so pandas can use its fast
+    fixed-format parser; values that don't fit it are parsed one by one (format="mixed"),
+    since a format guessed from the first leftover would misread e.g. ISO dates as %Y-%d-%m.
+    """
+    sample = series.dropna()
+    sample = str(sample.iloc[0]).strip() if len(sample) else ""
+    fmt = next((f for p, f in DATE_FORMATS if re.fullmatch(p, sample)), None)
+    if fmt is None:
+        return pd.to_datetime(series, dayfirst=True, errors="coerce")
+
+    dates = pd.to_datetime(series, format=fmt, errors="coerce")
+    rest = dates.isna() & series.notna()
+    if rest.any():
+        dates.loc[rest] = pd.to_datetime(series.loc[rest], format="mixed", dayfirst=True, errors="coerce")
+    return dates
+
+def format_amount_comma_decimal(series: pd.Series) -> pd.Series:
+    """Amounts as "1234,50" text ("" when missing), formatted in one NumPy pass."""
+    a = series.to_numpy(dtype=float, na_value=np.nan)
+    if not len(a):
+        return pd.Series([], index=series.index, dtype=object)
+    text = np.char.replace(np.char.mod("%.2f", a), ".", ",")
+    return pd.Series(np.where(np.isnan(a), "", text), index=series.index, dtype=object)
+
+def result_to_csv(result: pd.DataFrame, credit_col: str) -> bytes:
+    """CSV bytes (UTF-8 with BOM): numbers stay numeric, only Credit gets a decimal comma.
+
+    Written by pyarrow straight from the column buffers; text fields come out quoted.
+    """
+    table = pa.Table.from_pandas(result, preserve_index=False)
+    i = table.schema.get_field_index(credit_col)
+    table = table.set_column(i, credit_col, pa.array(format_amount_comma_decimal(result[credit_col]), pa.string()))
+
+    # Dates as pandas writes them: date only, unless some value carries a time of day
+    dates = result["Дата"]
+    date_type = pa.date32() if dates.dt.normalize().equals(dates) else pa.timestamp("s")
+    i = table.schema.get_field_index("Дата")
+    table = table.set_column(i, "Дата", table.column(i).cast(date_type, safe=False))
+
+    buf = BytesIO()
+    buf.write(b"\xef\xbb\xbf")  # BOM so Excel detects UTF-8
+    pacsv.write_csv(table, buf, pacsv.WriteOptions(quoting_style="needed"))
+    return buf.getvalue()
+
+def result_to_xlsx(result: pd.DataFrame, credit_col: str) -> bytes:
+    """Excel bytes with numeric types and number formats.
+
+    xlsxwriter runs in constant_memory mode, so rows are flushed as they are written. That mode
+    only keeps cells written in row order, which pandas' to_excel doesn't do (it goes column by
+    column), so the rows are written here directly.
+    """
+    buf = BytesIO()
+    try:
+        # Prefer xlsxwriter for easy column formats
+        with pd.ExcelWriter(buf, engine="xlsxwriter", engine_kwargs={"options": {"constant_memory": True}}) as writer:
+            wb = writer.book
+            ws = wb.add_worksheet("Result")
+
+            fmt_header = wb.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+            fmt_date   = wb.add_format({"num_format": "yyyy-mm-dd"})
+            fmt_int    = wb.add_format({"num_format": "#,##0"})
+            fmt_amount = wb.add_format({"num_format": "#,##0.00"})
+
+            col_idx = {col: i for i, col in enumerate(result.columns)}
+            col_fmt = [None] * len(result.columns)
+
+            if "Дата" in col_idx:
+                ws.set_column(col_idx["Дата"], col_idx["Дата"], 12, fmt_date)
+                col_fmt[col_idx["Дата"]] = fmt_date
+            for c in ["ВД", "ВП", "ІПН", "CaseID"]:
+                if c in col_idx:
+                    ws.set_column(col_idx[c], col_idx[c], 14, fmt_int)
+                    col_fmt[col_idx[c]] = fmt_int
+            if credit_col in col_idx:
+                ws.set_column(col_idx[credit_col], col_idx[credit_col], 16, fmt_amount)
+                col_fmt[col_idx[credit_col]] = fmt_amount
+
+            ws.write_row(0, 0, list(result.columns), fmt_header)
+            cells = result.astype(object).where(result.notna(), None)  # NaN/NaT/<NA> -> empty cell
+            for r, row in enumerate(cells.itertuples(index=False, name=None), start=1):
+                for c, val in enumerate(row):
+                    ws.write(r, c, val, col_fmt[c])
+    except ImportError:
+        # xlsxwriter not installed: fallback to openpyxl without custom formatting (still numeric types)
+        buf = BytesIO()
+        with pd.ExcelWriter(buf, engine="openpyxl") as writer:
+            result.to_excel(writer, index=False, sheet_name="Result")
+    return buf.getvalue()
+
+class MissingColumnsError(ValueError):
+    """Statement lacks required columns; keeps the detected headers to show the user."""
+
+    def __init__(self, missing: list[str], headers: list):
+        super().__init__(f"Missing required column(s): {', '.join(missing)}")
+        self.headers = headers
+
+def scan_chunks(chunks, purpose_col: str) -> tuple:
+    """Check headers, drop footer rows and keep credit > 0 rows of each chunk.
+
+    Returns (date_col, credit_col, total_rows, df_pos, amt_pos): the kept date/purpose
+    columns and their credit amounts, concatenated over all chunks.
+    """
+    # === Metrics base ===
+    total_rows = 0
+    pos_parts, amt_parts = [], []
+
+    for i, df in enumerate(chunks):
+        if i == 0:
+            # Every chunk has the same headers: normalize them (e.g., fix "Дата " with
+            # trailing spaces) and pick the required columns once per file
+            headers = [_clean_header(c) for c in df.columns]
+            df.columns = headers
+            date_col = pick_col(df, ["Дата", "Дата операції"])
+            credit_col = pick_col(df, ["Зараховано", "Кредит"])
+
+            missing = []
+            if date_col is None:
+                missing.append("Дата/Дата операції")
+            if credit_col is None:
+                missing.append("Зараховано/Кредит")
+            if purpose_col not in df.columns:
+                missing.append("Призначення платежу")
+
+            if missing:
+                raise MissingColumnsError(missing, list(df.columns))
+        else:
+            df.columns = headers
+
+        # Purpose is the only column scanned by regexes, so it's the only one held as text
+        df[purpose_col] = df[purpose_col].astype(STR_DTYPE)
+
+        # Skip summary/footer rows like "Всього за оборотами:" and "Кінцевий залишок:"
+        body = ~summary_mask(df)
+        total_rows += int(body.sum())
+
+        # Keep rows where credit > 0; only these rows, and only the columns used below, are copied
+        # out of the chunk (no intermediate full-width frame)
+        amt_num = parse_credit(df[credit_col])
+        keep = body & (amt_num > 0).to_numpy()
+        pos_parts.append(df.loc[keep, [date_col, purpose_col]])
+        amt_parts.append(amt_num.loc[keep])
+
+    df_pos = pd.concat(pos_parts, ignore_index=True)
+    amt_pos = pd.concat(amt_parts, ignore_index=True)
+    return date_col, credit_col, total_rows, df_pos, amt_pos
+
+@st.cache_data(max_entries=4, show_spinner="Parsing statement...")
+def parse_statement(file_bytes: bytes, name: str) -> tuple[dict, bytes, bytes]:
+    """Read the statement, keep credit > 0 rows and extract fields -> (stats, csv_bytes, xlsx_bytes).
+
+    Cached on the uploaded bytes, so Streamlit reruns (downloads, widget changes) don't re-parse.
+    The download files are built here too: a cache keyed on the result frame itself would hash
+    only a sample of rows for large frames and could hand back another statement's bytes.
+    """
+    name = name.lower()
+    src = BytesIO(file_bytes)
+
+    purpose_col = "Призначення платежу"
+
+    # Read file: CSV is streamed in blocks, Excel is read as a single chunk with native dtypes
+    if name.endswith(".csv"):
+        try:
+            scanned = scan_chunks(read_csv_chunks(src), purpose_col)
+        except pa.ArrowInvalid:
+            # Ragged rows (e.g. a short "Всього за оборотами:,1234.5" footer) or no data rows:
+            # pandas pads short rows with empty cells, so start over with its reader
+            src.seek(0)
+            scanned = scan_chunks(pd.read_csv(src, dtype=str, chunksize=CSV_CHUNK_ROWS), purpose_col)
+    else:
+        if name.endswith(".xlsx"):
+            try:
+                df = pd.read_excel(src, engine="calamine", header=0)  # Rust reader, much faster
+            except ImportError:
+                src.seek(0)
+                df = pd.read_excel(src, engine="openpyxl", header=0)
+        else:  # .xls
+            import xlrd  # ensure xlrd==2.0.1 in requirements
+            df = pd.read_excel(src, engine="xlrd", header=0)
+        scanned = scan_chunks([df], purpose_col)
+    date_col, credit_col, total_rows, df_pos, amt_pos = scanned
+
+    credit_pos_rows = len(df_pos)
+
+    # Extract fields from purpose (within filtered rows)
+    purpose = df_pos[purpose_col]
+    fields = extract_fields(purpose)
+
+    # ---- Counts (within credit > 0 subset) ----
+    stats = {
+        "total_rows": total_rows,
+        "credit_pos_rows": credit_pos_rows,
+        "cnt_vp": int((fields["ВП"] != "").sum()),
+        "cnt_vd": int((fields["ВД"] != "").sum()),
+        "cnt_ipn": int((fields["ІПН"] != "").sum()),
+        "cnt_caseid_found": int((fields["CaseID"] != "").sum()),
+        "cnt_nothing_found": int((fields[["ВП", "ВД", "ІПН", "CaseID"]] == "").all(axis=1).sum()),
+    }
+
+    # ---- Build result column by column (keep numeric dtypes) ----
+    # Order: Date, VD, VP, IPN, CaseID, Credit, Name, Purpose
+    result = pd.DataFrame(
+        {
+            "Дата": normalize_date_series(df_pos[date_col]),  # datetime64
+            # IDs to numeric Int64 (nullable integers)
+            **{c: pd.to_numeric(fields[c], errors="coerce").astype("Int64") for c in ["ВД", "ВП", "ІПН", "CaseID"]},
+            credit_col: amt_pos.astype(float),
+            "ПІБ": fields["ПІБ"],
+            purpose_col: purpose,
+        }
+    )
+    return stats, result_to_csv(result, credit_col), result_to_xlsx(result, credit_col)
 
 # ===== UI =====
 st.title("📑 Bank Statement Convertor")
@@ -129,119 +516,21 @@ uploaded = st.file_uploader("Choose a statement file", type=["csv", "xls", "xlsx
 
 if uploaded:
     try:
-        name = uploaded.name.lower()
+        stats, csv_bytes, xlsx_bytes = parse_statement(uploaded.getvalue(), uploaded.name)
 
-        # Read file
-        if name.endswith(".csv"):
-            df = pd.read_csv(uploaded, dtype=str)
-        elif name.endswith(".xlsx"):
-            df = pd.read_excel(uploaded, dtype=str, engine="openpyxl", header=0)
-        else:  # .xls
-            import xlrd  # ensure xlrd==2.0.1 in requirements
-            df = pd.read_excel(uploaded, dtype=str, engine="xlrd", header=0)
-
-        # Normalize headers (e.g., fix "Дата " with trailing spaces)
-        df = df.rename(columns=_clean_header)
-
-        # Drop summary/footer rows like "Всього за оборотами:" and "Кінцевий залишок:"
-        summary_re = re.compile(r"(всього\s+за\s+оборотами|кінцевий\s+залишок)", re.IGNORECASE)
-        row_text = df.astype(str).agg(" ".join, axis=1)
-        df = df.loc[~row_text.str.contains(summary_re, na=False)].copy()
-
-        # Pick required columns
-        date_col = pick_col(df, ["Дата", "Дата операції"])
-        credit_col = pick_col(df, ["Зараховано", "Кредит"])
-        purpose_col = "Призначення платежу"
-
-        missing = []
-        if date_col is None:
-            missing.append("Дата/Дата операції")
-        if credit_col is None:
-            missing.append("Зараховано/Кредит")
-        if purpose_col not in df.columns:
-            missing.append("Призначення платежу")
-
-        if missing:
-            st.error(f"Missing required column(s): {', '.join(missing)}")
-            st.write("Detected headers:", list(df.columns))
-            st.stop()
-
-        # === Metrics base ===
-        total_rows = len(df)
-
-        # Keep rows where credit > 0
-        amt_num = parse_amount(df[credit_col])
-        df_pos = df.loc[amt_num > 0].copy()
-        credit_pos_rows = len(df_pos)
-
-        # Extract fields from purpose (within filtered rows)
-        df_pos["Дата"] = normalize_date_series(df_pos[date_col])     # datetime dtype
-        df_pos["ВД"] = df_pos[purpose_col].map(extract_vd)
-        df_pos["ВП"] = df_pos[purpose_col].map(extract_vp)
-        df_pos["ІПН"] = df_pos[purpose_col].map(extract_ipn)
-        df_pos["CaseID"] = df_pos[purpose_col].map(extract_caseid)
-        df_pos["ПІБ"] = df_pos[purpose_col].map(extract_name)
-
-        # ---- Counts (within credit > 0 subset) ----
-        cnt_vp = (df_pos["ВП"] != "").sum()
-        cnt_vd = (df_pos["ВД"] != "").sum()
-        cnt_ipn = (df_pos["ІПН"] != "").sum()
-        cnt_caseid_found = (df_pos["CaseID"] != "").sum()
-        cnt_nothing_found = ((df_pos[["ВП", "ВД", "ІПН", "CaseID"]] == "").all(axis=1)).sum()
-
-        # ---- Build result (keep numeric dtypes) ----
-        # Order: Date, VD, VP, IPN, CaseID, Credit, Name, Purpose
-        result_cols = ["Дата", "ВД", "ВП", "ІПН", "CaseID", credit_col, "ПІБ", purpose_col]
-        result = df_pos[result_cols].copy()
-
-        # IDs to numeric Int64 (nullable integers)
-        for c in ["ВД", "ВП", "ІПН", "CaseID"]:
-            result[c] = pd.to_numeric(result[c], errors="coerce").astype("Int64")
-
-        # Date as datetime, Credit as float
-        result["Дата"] = df_pos["Дата"]                              # already datetime64
-        result[credit_col] = amt_num.loc[df_pos.index].astype(float)
-        
         # ---- Downloads ----
-        # CSV: keep numbers numeric; only format Credit with decimal comma for CSV text
-        csv_out = result.copy()
-        csv_out[credit_col] = csv_out[credit_col].map(
-            lambda x: ("" if pd.isna(x) else f"{x:.2f}".replace(".", ","))
-        )
+        # Both files come from the parse cache, so reruns (e.g. the other download click) reuse them
         st.download_button(
             "⬇️ Download CSV",
-            data=csv_out.to_csv(index=False).encode("utf-8-sig"),
+            data=csv_bytes,
             file_name="parsed_statement.csv",
             mime="text/csv",
         )
 
-        # Excel: write numeric types + apply number formats
-        buf = BytesIO()
-        try:
-            # Prefer xlsxwriter for easy column formats
-            with pd.ExcelWriter(buf, engine="xlsxwriter") as writer:
-                result.to_excel(writer, index=False, sheet_name="Result")
-                wb = writer.book
-                ws = writer.sheets["Result"]
-
-                fmt_date   = wb.add_format({"num_format": "yyyy-mm-dd"})
-                fmt_int    = wb.add_format({"num_format": "#,##0"})
-                fmt_amount = wb.add_format({"num_format": "#,##0.00"})
-
-                col_idx = {col: i for i, col in enumerate(result.columns)}
-
-                if "Дата" in col_idx: ws.set_column(col_idx["Дата"], col_idx["Дата"], 12, fmt_date)
-                for c in ["ВД", "ВП", "ІПН", "CaseID"]:
-                    if c in col_idx: ws.set_column(col_idx[c], col_idx[c], 14, fmt_int)
-                if credit_col in col_idx: ws.set_column(col_idx[credit_col], col_idx[credit_col], 16, fmt_amount)
-        except Exception:
-            # Fallback to openpyxl without custom formatting (still numeric types)
-            with pd.ExcelWriter(buf, engine="openpyxl") as writer:
-                result.to_excel(writer, index=False, sheet_name="Result")
-
+        # Excel: numeric types + number formats
         st.download_button(
             "⬇️ Download Excel",
-            data=buf.getvalue(),
+            data=xlsx_bytes,
             file_name="parsed_statement.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         )
@@ -249,18 +538,21 @@ if uploaded:
         
         # ---- Show metrics only (no table) ----
         st.subheader("Summary")
-        st.write(f"Total rows in file: **{total_rows}**")
-        st.write(f"Rows where Credit > 0: **{credit_pos_rows}**")
-        st.write(f"Rows with VP found: **{cnt_vp}**")
-        st.write(f"Rows with VD found: **{cnt_vd}**")
-        st.write(f"Rows with IPN found: **{cnt_ipn}**")
-        st.write(f"Rows with CaseID found: **{cnt_caseid_found}**")
-        st.write(f"Rows where nothing found (VP/VD/IPN/CaseID): **{cnt_nothing_found}**")
+        st.write(f"Total rows in file: **{stats['total_rows']}**")
+        st.write(f"Rows where Credit > 0: **{stats['credit_pos_rows']}**")
+        st.write(f"Rows with VP found: **{stats['cnt_vp']}**")
+        st.write(f"Rows with VD found: **{stats['cnt_vd']}**")
+        st.write(f"Rows with IPN found: **{stats['cnt_ipn']}**")
+        st.write(f"Rows with CaseID found: **{stats['cnt_caseid_found']}**")
+        st.write(f"Rows where nothing found (VP/VD/IPN/CaseID): **{stats['cnt_nothing_found']}**")
 
 
 
 
 
+    except MissingColumnsError as e:
+        st.error(str(e))
+        st.write("Detected headers:", e.headers)
     except ModuleNotFoundError:
         st.error("Excel engine is missing. For .xlsx add 'openpyxl'; for .xls add 'xlrd==2.0.1' to requirements.txt.")
     except Exception as e: